@@ -20,6 +20,12 @@ from component import component
 from emc import limit
 import json
 import os
+import pathlib
+# Use orjson to parse the parameters if it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 if __name__ == '__main__':
@@ -31,15 +37,15 @@ if __name__ == '__main__':
     param_file = 'params.txt'
     try:
         # Load the parameters from the params.txt file
-        with open(param_file) as fp:
-            params = json.load(fp)
+        with open(param_file,'rb') as fp:
+            params = json_loads(fp.read())
     except IOError:
         # Create default parameters and save the file
         params = {
             'title': 'Product X Radiated Emissions',
             'dir': 'trace_dir',
-            'antenna': 'component\\ab900a.csv',
-            'cable': 'component\\ASMA500B174L13.csv',
+            'antenna': 'component/ab900a.csv',
+            'cable': 'component/ASMA500B174L13.csv',
             'limit_std': 'cispr22classb',
             'limit_units': 'dBuV/m(3m)',
             'span': 100e6,
@@ -115,11 +121,10 @@ if __name__ == '__main__':
     
     #  Create a unique filename using the date and time
     d = datetime.datetime.now()
-    filename = '%s\\trace-%s' % (params['dir'], d.strftime('%Y-%m-%d-%H%M%S'))
+    filename = pathlib.Path(params['dir']) / f'trace-{d:%Y-%m-%d-%H%M%S}'
     
     # Create a directory for the measurement data
-    if not os.path.exists(params['dir']):
-        os.makedirs(params['dir'])
+    os.makedirs(params['dir'], exist_ok=True)
     
     # Write trace to CSV and PNG file
     measurement = storage.Measurement(params['title'],config)
@@ -127,8 +132,8 @@ if __name__ == '__main__':
     measurement.add_component(antenna)
     measurement.add_component(cable)
     measurement.add_limit(lim)
-    measurement.save_to_csv('%s.csv' % filename)
-    measurement.save_to_png('%s.png' % filename)
+    measurement.save_to_csv(str(filename.with_suffix('.csv')))
+    measurement.save_to_png(str(filename.with_suffix('.png')))
     
     # End the timer
     end_time = time.time()
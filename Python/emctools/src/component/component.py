@@ -22,9 +22,6 @@ gains or losses.
 '''
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import interpolate
-import csv
 
 """
 Component class
@@ -32,50 +29,67 @@ Component class
 class component(object):
     """ """
     def __init__(self,name,filename,loss=True):
-        # Read the gain/loss factor CSV file
-        with open(filename) as csvfile:
-            r = csv.reader(csvfile)
-            # Skip comments
-            line = next(r)
-            while line != ['Frequency','Factor']:
-                line = next(r)
-            # Read gain/loss factors into numpy array
-            self.factors = np.array(list(r),dtype=np.float)
         # Name of this component
         self.name = name
         # Gain or loss
         self.loss = loss
-        # f = frequency, gl = gain/loss factor 
-        f = self.factors.T[0]
-        gl = self.factors.T[1]
-        # Calculate the interpolation representation
-        self.tck = interpolate.splrep(f, gl, s=0)
+        # Read the gain/loss factor CSV file
+        self.load_csv(filename)
+        # Frequencies and gain/loss factors, contiguous for np.interp
+        self._f = np.ascontiguousarray(self.factors[:,0])
+        self._gl = np.ascontiguousarray(self.factors[:,1])
         # Start and end frequencies
-        self.start_freq = f[0]
-        self.stop_freq = f[-1]
+        self.start_freq = self._f[0]
+        self.stop_freq = self._f[-1]
         
-    """ Interpolated gain/loss factors for an array of frequencies """
+    """ Read the gain/loss factor CSV file """
+    def load_csv(self,filename):
+        # Find the header line, skipping the comments above it
+        with open(filename) as csvfile:
+            for header_line,line in enumerate(csvfile):
+                if line.strip() == 'Frequency,Factor':
+                    break
+            else:
+                raise Exception('Could not find Frequency,Factor header in %s' % filename)
+        # Read gain/loss factors into numpy array
+        self.factors = np.loadtxt(filename,delimiter=',',skiprows=header_line+1,
+                                  usecols=(0,1),dtype=np.float64,ndmin=2)
+        
+    """ Linearly interpolated gain/loss factors for an array of frequencies """
     def get_factors(self,freq):
-        return(interpolate.splev(freq, self.tck, der=0))
+        return(np.interp(freq, self._f, self._gl))
     
     """ Corrected measurement """
     def corrected_measurement(self,trace):
-        # tr[0] = frequency, tr[1] = measurement 
-        tr = trace.T
-        # Get interpolated gain/loss factors
-        gl = self.get_factors(tr[0])
-        # Return corrected measurement data
+        # Copy the trace (trace[:,0] = frequency, trace[:,1] = measurement)
+        # and correct the copy
+        corrected = np.array(trace,dtype=np.float64)
         if self.loss:
-            corrected = tr[1] + gl
+            corrected[:,1] += self.get_factors(corrected[:,0])
         else:
-            corrected = tr[1] - gl
-        return(np.array([tr[0],corrected]).T)
+            corrected[:,1] -= self.get_factors(corrected[:,0])
+        return(corrected)
+
+    """ Total correction of a list of components (optionally from already evaluated factors) """
+    @staticmethod
+    def total_correction(freq,components,factors=None):
+        if factors is None:
+            factors = [c.get_factors(freq) for c in components]
+        # Sum the gain/loss factors of all components
+        correction = np.zeros(np.shape(freq),dtype=np.float64)
+        for c,gl in zip(components,factors):
+            if c.loss:
+                correction += gl
+            else:
+                correction -= gl
+        return(correction)
 
 
 if __name__ == '__main__':
     """
     Displays the gain/loss factors and the interpolation
     """
+    import matplotlib.pyplot as plt
     
     # Create the compoment
     antenna = component('Antenna factor','ab900a.csv',loss = True)
@@ -89,6 +103,6 @@ if __name__ == '__main__':
     
     plt.figure()
     plt.plot(f, gl, 'x', f_new, af_new)
-    plt.title('Gain/loss factors cubic-spline interpolation')
+    plt.title('Gain/loss factors linear interpolation')
     plt.show()
 
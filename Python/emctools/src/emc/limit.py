@@ -7,7 +7,6 @@ for a given array of frequencies.
 '''
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 """
 Limit class to represent emissions limits
@@ -32,19 +31,39 @@ class limit(object):
             }
         # Limit unit indexes
         self.unit_index = {'uV/m(3m)':2,'dBuV/m(3m)':3,'uV/m(10m)':4,'dBuV/m(10m)':5}
+        # Check the standard and units
+        if standard not in self.limit_table:
+            raise Exception('Standard must be: %s' % ', '.join(self.limit_table.keys()))
+        if units not in self.unit_index:
+            raise Exception('Units must be: %s' % ', '.join(self.unit_index.keys()))
         # Standard name and units
         self.standard = standard
         self.units = units
+        # Limit tables as arrays, one row per band, one column per field
+        self._tables = {}
+        for std,bands in self.limit_table.items():
+            self._tables[std] = np.array(bands,dtype=np.float64)
+        table = self._tables[standard]
+        # The band lookup requires contiguous bands in increasing order
+        if np.any(table[:,0] >= table[:,1]) or np.any(table[1:,0] != table[:-1,1]):
+            raise Exception('Bands of %s must be contiguous and increasing' % standard)
+        # Upper band edges of the standard for fast lookup. The first edge is
+        # nudged below the start frequency of the first band so that the start
+        # frequency itself falls within that band.
+        lo = np.nextafter(table[0,0],-np.inf)
+        self._edges_hi = np.concatenate(([lo],table[:,1]))
+        # Limit values in the selected units in band order, with a zero on
+        # either side for frequencies outside of the bands
+        self._values = np.concatenate(([0],table[:,self.unit_index[units]],[0]))
         
-    """ The limits for a given array of frequencies """
-    def limit_func(self,freq):
-        # Create a limit vector the same length as the freq vector
-        limit_vec = np.zeros_like(freq)
-        # Iterate through the table and apply the appropriate limit
-        for l in self.limit_table[self.standard]:
-            limit_vec[np.logical_and(freq > l[0],freq <= l[1])] = l[self.unit_index[self.units]]
-        # Handle the lower limit condition
-        limit_vec[freq == self.limit_table[self.standard][0][0]] = self.limit_table[self.standard][0][self.unit_index[self.units]]
+    """ The limits for a given array of frequencies (optionally written to out) """
+    def limit_func(self,freq,out=None):
+        # Find the band of each frequency with a single binary search. Bands
+        # include their upper edge, so the lower limit applies at a transition
+        # frequency, and the first band also includes its start frequency.
+        idx = np.searchsorted(self._edges_hi,freq,side='left')
+        # Gather the limit value of each band
+        limit_vec = np.take(self._values,idx,out=out)
         return(limit_vec)
     
 
@@ -53,6 +72,8 @@ if __name__ == '__main__':
     """
     Displays the emissions limit
     """
+    import matplotlib.pyplot as plt
+    
     # Create the limit object
     l = limit('cispr22classb','dBuV/m(3m)')
     
@@ -27,12 +27,13 @@ References:
 """
 
 import visa
-import time
 import numpy as np
 import sys
 from enum import Enum
 import json
 import csv
+import asyncio
+import functools
 
 """
 Setting dicts
@@ -45,7 +46,7 @@ use dicts to convert the query results to the names used when we write. This
 allows for uniformity when storing settings.
 """
 
-DATA_FORMAT = {'ASCII':'ASCii', 'REAL': 'REAL'}
+DATA_FORMAT = {'ASCII':'ASCii', 'REAL': 'REAL', 'REAL,32': 'REAL'}
     
 UNITS = {'DBM': 'DBM', 'DBMV': 'DBMV', 'DBUV': 'DBUV', 'V': 'V', 'W': 'W'}
 
@@ -61,6 +62,36 @@ DET_FUNC = {'NEG': 'NEGative', 'NORM': 'NORMal',
 
 SWEEP_TIME_METHOD = {'NORM': 'NORMal', 'ACC': 'ACCuracy'}
 
+"""
+Sets of the setting names for fast validation, and lookups that convert
+query results regardless of their case or any stray whitespace
+"""
+
+DATA_FORMAT_VALUES = frozenset(DATA_FORMAT.values())
+DATA_FORMAT_LOOKUP = {k.upper(): v for k, v in DATA_FORMAT.items()}
+
+UNITS_VALUES = frozenset(UNITS.values())
+UNITS_LOOKUP = {k.upper(): v for k, v in UNITS.items()}
+
+TRACE_MODE_VALUES = frozenset(TRACE_MODE.values())
+TRACE_MODE_LOOKUP = {k.upper(): v for k, v in TRACE_MODE.items()}
+
+DET_FUNC_VALUES = frozenset(DET_FUNC.values())
+DET_FUNC_LOOKUP = {k.upper(): v for k, v in DET_FUNC.items()}
+
+SWEEP_TIME_METHOD_VALUES = frozenset(SWEEP_TIME_METHOD.values())
+SWEEP_TIME_METHOD_LOOKUP = {k.upper(): v for k, v in SWEEP_TIME_METHOD.items()}
+
+# Trace modes that accumulate over sweeps and must be reset between ranges
+TRACE_MODE_ACCUMULATE = ('MAXHold', 'MINHold', 'VIDeoavg', 'POWeravg')
+
+# Boolean query responses that mean on/true
+_VISA_TRUE = frozenset(('1', 'ON'))
+
+""" True if a boolean query response means on, ignoring case and stray whitespace """
+def _is_on(response):
+    return response.strip().upper() in _VISA_TRUE
+
 
 """
 DSA800 class to represent the spectrum analyzer
@@ -71,40 +102,62 @@ class dsa800(object):
         # Create the resource manager
         self.rm = visa.ResourceManager()
         self.resource = None
+        # Last known trace data format of the DSA (None if unknown)
+        self.data_format = None
         self.config_func = {
-            'data_format' : {'set':self.set_data_format,'get':self.get_data_format},
-            'sweep_points' : {'set':self.set_sweep_points,'get':self.get_sweep_points},
-            'trace_mode' : {'set':self.set_trace_mode,'get':self.get_trace_mode},
-            'preamp_en' : {'set':self.set_preamp_en,'get':self.get_preamp_en},
-            'units' : {'set':self.set_unit,'get':self.get_unit},
-            'emi_filter_en' : {'set':self.set_emi_filter_en,'get':self.get_emi_filter_en},
-            'rbw' : {'set':self.set_rbw,'get':self.get_rbw},
-            'tg_en' : {'set':self.set_tg_output_en,'get':self.get_tg_output_en},
-            'tg_amplitude' : {'set':self.set_tg_amplitude,'get':self.get_tg_amplitude},
-            'det_func' : {'set':self.set_detector_function,'get':self.get_detector_function},
+            'data_format' : {'set':self.set_data_format,'get':self.get_data_format,'cmd':self.cmd_data_format},
+            'sweep_points' : {'set':self.set_sweep_points,'get':self.get_sweep_points,'cmd':self.cmd_sweep_points},
+            'trace_mode' : {'set':self.set_trace_mode,'get':self.get_trace_mode,'cmd':self.cmd_trace_mode},
+            'preamp_en' : {'set':self.set_preamp_en,'get':self.get_preamp_en,'cmd':self.cmd_preamp_en},
+            'units' : {'set':self.set_unit,'get':self.get_unit,'cmd':self.cmd_unit},
+            'emi_filter_en' : {'set':self.set_emi_filter_en,'get':self.get_emi_filter_en,'cmd':self.cmd_emi_filter_en},
+            'rbw' : {'set':self.set_rbw,'get':self.get_rbw,'cmd':self.cmd_rbw},
+            'tg_en' : {'set':self.set_tg_output_en,'get':self.get_tg_output_en,'cmd':self.cmd_tg_output_en},
+            'tg_amplitude' : {'set':self.set_tg_amplitude,'get':self.get_tg_amplitude,'cmd':self.cmd_tg_amplitude},
+            'det_func' : {'set':self.set_detector_function,'get':self.get_detector_function,'cmd':self.cmd_detector_function},
             }
 
+    """ Use the DSA object as a context manager that closes the connection on exit """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     """ Returns a list of detected VISA resource names """
     def list_devices(self):
+        # Reopen the resource manager if it was closed
+        if self.rm is None:
+            self.rm = visa.ResourceManager()
         return self.rm.list_resources()
         
     """ Connect to the DSA using the id string """
     def connect(self, idn=None):
         self.resource = None
+        self.data_format = None
+        # Reopen the resource manager if it was closed
+        if self.rm is None:
+            self.rm = visa.ResourceManager()
         # If VISA ID provided, then connect to that ID
         if idn:
-            self.resource = self.rm.open_resource(idn,send_end=True,query_delay=1)
+            self.resource = self.rm.open_resource(idn,send_end=True)
         # Otherwise search for a connected DSA800
         else:
             devices = self.list_devices()
             for d in devices:
                 if d.split('::')[-2].startswith('DSA8'):
-                    self.resource = self.rm.open_resource(d,send_end=True,query_delay=1)
+                    self.resource = self.rm.open_resource(d,send_end=True)
             if self.resource == None:
                 raise Exception('Could not find DSA800, please make sure DSA is connected')
         self.resource.read_termination = '\n'
         self.resource.write_termination = '\n'
         self.resource.timeout = 5000
+        # Read large traces in as few low-level VISA reads as possible
+        self.resource.chunk_size = 1<<20
+
+    """ Query a boolean setting, tolerant of case and stray whitespace """
+    def _query_bool(self, scpi):
+        return _is_on(self.resource.query(scpi))
 
     """ Get the DSA identification string """
     def get_id(self):
@@ -112,16 +165,13 @@ class dsa800(object):
 
     """ Get operation finished """
     def get_opc(self):
-        if self.resource.query("*OPC?") == '1':
-            return(True)
-        else:
-            return(False)
+        return self._query_bool("*OPC?")
 
     """ Trigger a sweep or measurement immediately """
     def trigger(self):
         self.resource.write("*TRG")
 
-    """ Parse ASCII trace data into a list of numpy floats """
+    """ Parse ASCII trace data into a numpy array of floats """
     def parse_ascii(self,data):
         # The first character should be '#'
         if data[0] != '#':
@@ -129,11 +179,12 @@ class dsa800(object):
         # The second character should be '9'
         if data[1] != '9':
             return None
-        # Remove the commas
-        data = data.replace(',','')
-        # Split the data by spaces
-        str_list = data.split()
-        return np.array(str_list[1:],np.float)
+        # Skip the '#9' and the 9 length digits of the block header
+        payload = data[11:]
+        # Parse the comma (or space) separated values in a single pass,
+        # whitespace around the commas is ignored by the parser
+        sep = ',' if ',' in payload else ' '
+        return np.fromstring(payload,dtype=np.float64,sep=sep)
 
     """ Calibrate all """
     def calibrate(self):
@@ -148,11 +199,7 @@ class dsa800(object):
 
     """ Get auto calibrate enable """
     def get_auto_calibration_en(self):
-        en = self.resource.query(":CALibration:AUTO?")
-        if(en == "1"):
-            return True
-        else:
-            return False
+        return self._query_bool(":CALibration:AUTO?")
         
     """ Set continuous enable (True,False) """
     def set_continuous_en(self, en):
@@ -163,11 +210,7 @@ class dsa800(object):
 
     """ Get continuous enabled (True,False) """
     def get_continuous_en(self):
-        en = self.resource.query(":INITiate:CONTinuous?")
-        if((en == "ON") or (en == "1")):
-            return True
-        else:
-            return False
+        return self._query_bool(":INITiate:CONTinuous?")
 
     """ In single measurement mode, trigger a sweep or measurement immediately """
     def trigger_single_sweep(self):
@@ -209,62 +252,77 @@ class dsa800(object):
     def get_stop_freq(self):
         return int(self.resource.query(":SENSe:FREQ:STOP?"))
 
-    """ Set preamp enabled (True,False) """
-    def set_preamp_en(self,en):
+    """ Set start and stop frequency in Hz and read back start, stop and span in one query """
+    def _set_and_verify_sweep(self,start,stop):
+        result = self.resource.query(
+            ":SENSe:FREQ:STARt %d;:SENSe:FREQ:STOP %d;"
+            ":SENSe:FREQ:STARt?;:SENSe:FREQ:STOP?;:SENSe:FREQ:SPAN?" % (start,stop))
+        return(tuple(int(float(v)) for v in result.split(';')))
+
+    """ SCPI command to set preamp enabled (True,False) """
+    def cmd_preamp_en(self,en):
         if en:
-            self.resource.write(":SENSe:POW:GAIN ON")
+            return(":SENSe:POW:GAIN ON")
         else:
-            self.resource.write(":SENSe:POW:GAIN OFF")
+            return(":SENSe:POW:GAIN OFF")
+
+    """ Set preamp enabled (True,False) """
+    def set_preamp_en(self,en):
+        self.resource.write(self.cmd_preamp_en(en))
             
     """ Get preamp enabled (True,False) """
     def get_preamp_en(self):
-        en = self.resource.query(":SENSe:POW:GAIN?")
-        if((en == "ON") or (en == "1")):
-            return True
-        else:
-            return False
+        return self._query_bool(":SENSe:POW:GAIN?")
         
-    """ Set TG output enabled (True,False) """
-    def set_tg_output_en(self, en):
+    """ SCPI command to set TG output enabled (True,False) """
+    def cmd_tg_output_en(self, en):
         if en:
-            self.resource.write(":OUTput:STATe ON")
+            return(":OUTput:STATe ON")
         else:
-            self.resource.write(":OUTput:STATe OFF")
+            return(":OUTput:STATe OFF")
+
+    """ Set TG output enabled (True,False) """
+    def set_tg_output_en(self, en):
+        self.resource.write(self.cmd_tg_output_en(en))
 
     """ Get TG output enabled (True,False) """
     def get_tg_output_en(self):
-        en = self.resource.query(":OUTput:STATe?")
-        if((en == "ON") or (en == "1")):
-            return True
-        else:
-            return False
+        return self._query_bool(":OUTput:STATe?")
+
+    """ SCPI command to set TG output amplitude (dBm: -40 to 0, integer) """
+    def cmd_tg_amplitude(self, dbm):
+        return(":SOURce:POWer:LEVel:IMMediate:AMPLitude %d" % dbm)
 
     """ Set TG output amplitude (dBm: -40 to 0, integer) """
     def set_tg_amplitude(self, dbm):
-        self.resource.write(":SOURce:POWer:LEVel:IMMediate:AMPLitude %d" % dbm)
+        self.resource.write(self.cmd_tg_amplitude(dbm))
 
     """ Get TG output amplitude (dBm: -40 to 0, integer) """
     def get_tg_amplitude(self):
         return int(self.resource.query(":SOURce:POWer:LEVel:IMMediate:AMPLitude?"))
 
-    """ Set EMI filter enabled (True,False) """
-    def set_emi_filter_en(self, en):
+    """ SCPI command to set EMI filter enabled (True,False) """
+    def cmd_emi_filter_en(self, en):
         if en:
-            self.resource.write(":SENSe:BANDwidth:EMIFilter:STATe ON")
+            return(":SENSe:BANDwidth:EMIFilter:STATe ON")
         else:
-            self.resource.write(":SENSe:BANDwidth:EMIFilter:STATe OFF")
+            return(":SENSe:BANDwidth:EMIFilter:STATe OFF")
+
+    """ Set EMI filter enabled (True,False) """
+    def set_emi_filter_en(self, en):
+        self.resource.write(self.cmd_emi_filter_en(en))
 
     """ Get EMI filter enabled (True,False) """
     def get_emi_filter_en(self):
-        en = self.resource.query(":SENSe:BANDwidth:EMIFilter:STATe?")
-        if((en == "ON") or (en == "1")):
-            return True
-        else:
-            return False
+        return self._query_bool(":SENSe:BANDwidth:EMIFilter:STATe?")
+
+    """ SCPI command to set resolution bandwidth (RBW) """
+    def cmd_rbw(self,freq):
+        return(":SENSe:BAND %d" % freq)
 
     """ Set resolution bandwidth (RBW) """
     def set_rbw(self,freq):
-        self.resource.write(":SENSe:BAND %d" % freq)
+        self.resource.write(self.cmd_rbw(freq))
     
     """ Get resolution bandwidth (RBW) """
     def get_rbw(self):
@@ -285,9 +343,13 @@ class dsa800(object):
     def get_sweep_count(self):
         return int(self.resource.query(":SENSe:SWEep:COUNt?"))
     
+    """ SCPI command to set sweep points (101 to 3001) """
+    def cmd_sweep_points(self,points):
+        return(":SENSe:SWEep:POINts %d" % points)
+
     """ Set sweep points (101 to 3001) """
     def set_sweep_points(self,points):
-        self.resource.write(":SENSe:SWEep:POINts %d" % points)
+        self.resource.write(self.cmd_sweep_points(points))
     
     """ Get sweep points (101 to 3001) """
     def get_sweep_points(self):
@@ -303,72 +365,117 @@ class dsa800(object):
     
     """ Set the setting method of the auto sweep time (NORMal, ACCuracy) """
     def set_sweep_time_method(self,setting):
-        if setting in SWEEP_TIME_METHOD.values():
+        if setting in SWEEP_TIME_METHOD_VALUES:
             self.resource.write(":SENSe:SWEep:TIME:AUTO:RULes %s" % setting)
         else:
-            print('Sweep time method must be:',', '.join(SWEEP_TIME_METHOD.values()))
+            print('Sweep time method must be:',', '.join(sorted(SWEEP_TIME_METHOD_VALUES)))
     
     """ Get the setting method of the auto sweep time (NORMal, ACCuracy) """
     def get_sweep_time_method(self):
         setting = self.resource.query(":SENSe:SWEep:TIME:AUTO:RULes?")
-        return(SWEEP_TIME_METHOD[setting])
+        return(SWEEP_TIME_METHOD_LOOKUP[setting.strip().upper()])
     
     """ Get trace data """
     def get_trace(self):
+        # Only query the data format if it is not already known
+        if self.data_format is None:
+            self.get_data_format()
+        if self.data_format == 'REAL':
+            return(self.get_trace_binary())
+        # ASCii format
         result = self.resource.query(":TRACe:DATA? TRACE1")
         return(self.parse_ascii(result))
+
+    """ Get trace data in REAL format (IEEE 488.2 binary block of 32-bit floats) """
+    def get_trace_binary(self):
+        if self.data_format != 'REAL':
+            self.set_data_format('REAL')
+        trace = self.resource.query_binary_values(":TRACe:DATA? TRACE1",
+            datatype='f',is_big_endian=False,container=np.ndarray)
+        return(trace.astype(np.float64))
         
+    """ SCPI command to set data format (ASCii,REAL), None if invalid """
+    def cmd_data_format(self,value):
+        if value in DATA_FORMAT_VALUES:
+            return(":FORMat:TRACe:DATA %s" % value)
+        else:
+            print('Data format must be:',', '.join(sorted(DATA_FORMAT_VALUES)))
+            return(None)
+
     """ Set data format (ASCii,REAL) """
     def set_data_format(self,value):
-        if value in DATA_FORMAT.values():
-            self.resource.write(":FORMat:TRACe:DATA %s" % value)
-        else:
-            print('Data format must be:',', '.join(DATA_FORMAT.values()))
+        cmd = self.cmd_data_format(value)
+        if cmd:
+            self.resource.write(cmd)
+            self.data_format = value
         
     """ Get data format (ASCii,REAL) """
     def get_data_format(self):
         value = self.resource.query(":FORMat:TRACe:DATA?")
-        return(DATA_FORMAT[value])
+        self.data_format = DATA_FORMAT_LOOKUP[value.strip().upper()]
+        return(self.data_format)
         
+    """ SCPI command to set detector function, None if invalid """
+    def cmd_detector_function(self,func):
+        if func in DET_FUNC_VALUES:
+            return(":DETector:FUNCtion %s" % func)
+        else:
+            print('Detector function must be:',', '.join(sorted(DET_FUNC_VALUES)))
+            return(None)
+
     """ Set detector function (NEGative,NORMal,POSitive,RMS,SAMPle,VAVerage,QPEak) """
     def set_detector_function(self,func):
-        if func in DET_FUNC.values():
-            self.resource.write(":DETector:FUNCtion %s" % func)
-        else:
-            print('Detector function must be:',', '.join(DET_FUNC.values()))
+        cmd = self.cmd_detector_function(func)
+        if cmd:
+            self.resource.write(cmd)
         
     """ Get detector function (NEGative,NORMal,POSitive,RMS,SAMPle,VAVerage,QPEak) """
     def get_detector_function(self):
         func = self.resource.query(":DETector:FUNCtion?")
-        return(DET_FUNC[func])
+        return(DET_FUNC_LOOKUP[func.strip().upper()])
         
+    """ SCPI command to set trace mode, None if invalid """
+    def cmd_trace_mode(self,mode):
+        if mode in TRACE_MODE_VALUES:
+            return(":TRACe1:MODE %s" % mode)
+        else:
+            print('Trace mode must be:',', '.join(sorted(TRACE_MODE_VALUES)))
+            return(None)
+
     """ Set trace mode (WRITe, MAXHold, MINHold, VIEW, BLANk, VIDeoavg, POWeravg) """
     def set_trace_mode(self,mode):
-        if mode in TRACE_MODE.values():
-            self.resource.write(":TRACe1:MODE %s" % mode)
-        else:
-            print('Trace mode must be:',', '.join(TRACE_MODE.values()))
+        cmd = self.cmd_trace_mode(mode)
+        if cmd:
+            self.resource.write(cmd)
         
     """ Get trace mode (WRITe, MAXHold, MINHold, VIEW, BLANk, VIDeoavg, POWeravg) """
     def get_trace_mode(self):
         mode = self.resource.query(":TRACe1:MODE?")
-        return(TRACE_MODE[mode])
+        return(TRACE_MODE_LOOKUP[mode.strip().upper()])
         
+    """ SCPI command to set units (DBM, DBMV, DBUV, V, W), None if invalid """
+    def cmd_unit(self,unit):
+        if unit in UNITS_VALUES:
+            return(":UNIT:POWer %s" % unit)
+        else:
+            print('Units must be:',', '.join(sorted(UNITS_VALUES)))
+            return(None)
+
     """ Set units (DBM, DBMV, DBUV, V, W) """
     def set_unit(self,unit):
-        if unit in UNITS.values():
-            self.resource.write(":UNIT:POWer %s" % unit)
-        else:
-            print('Units must be:',', '.join(UNITS.values()))
+        cmd = self.cmd_unit(unit)
+        if cmd:
+            self.resource.write(cmd)
         
     """ Get units (DBM, DBMV, DBUV, V, W)"""
     def get_unit(self):
         unit = self.resource.query(":UNIT:POWer?")
-        return(UNITS[unit])
+        return(UNITS_LOOKUP[unit.strip().upper()])
         
     """ Recall the preset setting """
     def preset(self):
         self.resource.write(":SYSTem:PRESet")
+        self.data_format = None
         
     """ Send (install) a purchased license key """
     def send_license_key(self,key):
@@ -376,77 +483,138 @@ class dsa800(object):
         
     """ Set DSA configuration """
     def set_config(self,config):
-        # Iterate through the parameters and set them
-        for setting,value in config.param.items():
-            self.config_func[setting]['set'](value)
-        # Wait for config to be applied
-        time.sleep(1)
+        # Build the SCPI command of each parameter (skipping invalid values),
+        # the message is kept on the config until its parameters change
+        key = config.param_key()
+        if config.compiled is None or key != config.compiled_key:
+            cmds = [self.config_func[setting]['cmd'](value)
+                    for setting,value in config.param.items()]
+            config.compiled = ';'.join(c for c in cmds if c)
+            config.compiled_key = key
+        # Send all of the commands in a single message, ending with *OPC? so
+        # that the reply only comes once the config has been applied
+        if config.compiled:
+            self.resource.query(config.compiled + ';*OPC?')
+        # Remember the data format if it was set
+        if config.param.get('data_format') in DATA_FORMAT_VALUES:
+            self.data_format = config.param['data_format']
         
-    """ Get trace (advanced) - returns 2-dim numpy array of floats """
-    def get_trace_adv(self,start_freq,stop_freq,span,sweeps=1):
+    """ Get trace (advanced) - returns 2-dim numpy array of floats (optionally written to the first rows of out) """
+    def get_trace_adv(self,start_freq,stop_freq,span,sweeps=1,out=None):
+        # Check the output array before taking the measurement
+        if out is not None and (out.dtype != np.float64 or out.ndim != 2 or out.shape[1] != 2):
+            raise ValueError('Output array must be a float64 array of shape (m, 2)')
         # Record current settings
         continuous_sweep = self.get_continuous_en()
         sweep_count = self.get_sweep_count()
         auto_calib = self.get_auto_calibration_en()
-        # Use single sweep mode and requested sweep count
-        self.set_sweep_count(sweeps)
-        self.set_continuous_en(False)
-        # Disable auto calibration during the measurement
-        self.set_auto_calibration_en(False)
-        # Remember the trace mode, because we need to reset this for each step
-        trace_mode = self.get_trace_mode()
-        # Initialize start frequency and trace list
-        start_f = start_freq
-        trace = np.array([],np.float)
-        while(start_f < stop_freq):
-            # Set the trace mode to reset the trace
-            self.set_trace_mode(trace_mode)
-            # Set the start freq
-            print("Setting start freq to:",start_f)
-            self.set_start_freq(start_f)
-            # Set the stop freq
-            self.set_stop_freq(start_f + span)
-            print("Start:",self.get_start_freq(),"Stop:",self.get_stop_freq(),"Span:",self.get_span())
-            # Calculate time expected to complete all sweeps and wait
-            wait_time = self.get_sweep_time() * sweeps * 0.9
-            # Trigger a single sweep
-            self.trigger_single_sweep()
-            # Sleep for the expected completion time
-            time.sleep(wait_time)
-            # Wait until sweep count reaches the total count
-            sweep_current = self.get_sweep_count_current()
-            while sweep_current < sweeps:
-                time.sleep(1)
-                sweep_current = self.get_sweep_count_current()
-            # Read the trace data
-            trace_data = self.get_trace()
-            # Append all data except the last point
-            trace = np.append(trace,trace_data[:-1])
-            # Increment the start freq
-            start_f = start_f + span
-        
-        # Return to original sweep settings
-        self.set_continuous_en(continuous_sweep)
-        self.set_sweep_count(sweep_count)
-        self.set_auto_calibration_en(auto_calib)
+        try:
+            # Use single sweep mode and requested sweep count
+            self.set_sweep_count(sweeps)
+            self.set_continuous_en(False)
+            # Disable auto calibration during the measurement
+            self.set_auto_calibration_en(False)
+            # Remember the trace mode, because accumulating modes need to be
+            # reset for each step
+            trace_mode = self.get_trace_mode()
+            reset_trace = trace_mode in TRACE_MODE_ACCUMULATE
+            # Number of segments and points per segment
+            n_seg = int(np.ceil((stop_freq - start_freq) / span))
+            points = self.get_sweep_points()
+            # Allocate the trace for all segments, each segment shares its last
+            # point with the first point of the next segment
+            trace = np.empty(n_seg * (points - 1) + 1,dtype=np.float64)
+            for i in range(n_seg):
+                start_f = start_freq + i * span
+                # Set the trace mode to reset the accumulated trace
+                if reset_trace:
+                    self.set_trace_mode(trace_mode)
+                # Set the start and stop freq and read back what the DSA applied
+                start_r,stop_r,span_r = self._set_and_verify_sweep(start_f,start_f + span)
+                print("Start:",start_r,"Stop:",stop_r,"Span:",span_r)
+                # Calculate time expected to complete all sweeps, every segment
+                # has the same span so the sweep time only needs to be read once
+                if i == 0:
+                    wait_time = self.get_sweep_time() * sweeps
+                # Trigger a single sweep and block until all sweeps are complete,
+                # with a VISA timeout long enough to cover the expected time (a
+                # sweep that does not complete in time raises a timeout error)
+                timeout = self.resource.timeout
+                self.resource.timeout = max(timeout,int(wait_time * 1500))
+                try:
+                    self.resource.query(":INITiate:IMMediate;*WAI;*OPC?")
+                finally:
+                    self.resource.timeout = timeout
+                # Read the trace data
+                trace_data = self.get_trace()
+                # Store all data except the last point
+                trace[i * (points - 1):(i + 1) * (points - 1)] = trace_data[:-1]
+        finally:
+            # Return to original sweep settings, also when a sweep failed
+            self.set_continuous_en(continuous_sweep)
+            self.set_sweep_count(sweep_count)
+            self.set_auto_calibration_en(auto_calib)
         
-        # Append the endpoint
-        trace = np.append(trace,trace_data[-1])
+        # Store the endpoint
+        trace[-1] = trace_data[-1]
         
-        # Generate the frequency points
-        freq = np.linspace(start_freq,self.get_stop_freq(),len(trace))
+        # The frequency points are evenly spaced from start_freq, so the
+        # number of points below the stop frequency follows from the step
+        step = span / (points - 1)
+        n = min(int(np.ceil((stop_freq - start_freq) / step)),len(trace))
+        # Correct for rounding in the division
+        if n > 0 and start_freq + (n - 1) * step >= stop_freq:
+            n -= 1
+        elif n < len(trace) and start_freq + n * step < stop_freq:
+            n += 1
         
-        return(np.array([freq[freq < stop_freq],trace[freq < stop_freq]]).T)
+        # Write frequencies and trace into one contiguous nx2 array, or into
+        # the first n rows of the output array
+        if out is None:
+            out = np.empty((n,2),dtype=np.float64)
+        elif out.shape[0] < n:
+            raise ValueError('Output array must have at least %d rows' % n)
+        else:
+            out = out[:n]
+        out[:,0] = np.arange(n) * step + start_freq
+        out[:,1] = trace[:n]
+        return(out)
+    
+    """ Get trace (advanced) from a coroutine, running the blocking VISA I/O in a worker thread """
+    async def get_trace_adv_async(self,start_freq,stop_freq,span,sweeps=1,out=None):
+        loop = asyncio.get_event_loop()
+        get_trace = functools.partial(self.get_trace_adv,start_freq,stop_freq,span,sweeps,out)
+        return(await loop.run_in_executor(None,get_trace))
     
-    """ Close the connection to the resource """
+    """ Close the connection to the resource and the resource manager (safe to call twice) """
     def close(self):
-        self.resource.close()
+        try:
+            if self.resource is not None:
+                self.resource.close()
+        finally:
+            # Release the resource manager even if the resource could not be
+            # closed (e.g. the link dropped), so that close() can be repeated
+            self.resource = None
+            if self.rm is not None:
+                try:
+                    self.rm.close()
+                except Exception:
+                    pass
+                self.rm = None
 
 """
 DSA800 configuration class for storing a particular configuration
 """
 class dsa800_config():
     def __init__(self,param=None,json_keys=None,json_values=None):
+        # SCPI message that applies this configuration, built by dsa800.set_config,
+        # and the parameters it was built from
+        self.compiled = None
+        self.compiled_key = None
+        # JSON strings of the parameter names and values, and the parameters
+        # they were built from
+        self._json_cache = None
+        self._json_key = None
         # If given a list of keys and values as JSON strings
         if json_keys and json_values:
             key_list = [json.loads(k) for k in json_keys]
@@ -455,7 +623,7 @@ class dsa800_config():
         else:
             # Default parameters
             self.param = {
-                'data_format' : 'ASCii',
+                'data_format' : 'REAL',
                 'trace_mode' : 'WRITe',
                 'sweep_points' : 601,
                 'preamp_en' : False,
@@ -470,11 +638,25 @@ class dsa800_config():
             if param:
                 self.param.update(param)
             
+    """ Snapshot of the parameters, compared to tell if a cached value is stale """
+    def param_key(self):
+        # The type is included so that True and 1 are not taken as equal
+        return(tuple((k,type(v),v) for k,v in self.param.items()))
+
+    """ JSON strings of the parameter names and values, built once until the parameters change """
+    def get_json(self):
+        key = self.param_key()
+        if self._json_cache is None or key != self._json_key:
+            self._json_cache = ([json.dumps(k) for k in self.param.keys()],
+                                [json.dumps(v) for v in self.param.values()])
+            self._json_key = key
+        return(self._json_cache)
+
     def get_json_names(self):
-        return([json.dumps(k) for k in self.param.keys()])
+        return(self.get_json()[0])
 
     def get_json_values(self):
-        return([json.dumps(v) for v in self.param.values()])
+        return(self.get_json()[1])
     
         
         
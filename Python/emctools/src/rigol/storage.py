@@ -5,6 +5,7 @@ The goal is to be able to store all measurement parameters
 so that a measurement can be replicated.
 '''
 import rigol.dsa800
+from component.component import component
 import matplotlib.pyplot as plt
 import numpy as np
 import csv
@@ -12,15 +13,16 @@ import csv
 
 class Measurement(object):
     def __init__(self,title=None,dsaconfig=None,filename=None):
+        self.components = []
+        self.lim = None
+        # Cached corrected measurement and limit
+        self.corrected_data = None
+        self.limit_data = None
         if filename:
             self.load_csv(filename)
         else:
             self.title = title
             self.config = dsaconfig
-        self.components = []
-        self.lim = None
-        self.corrected_data = None
-        self.limit_data = None
         
     def freq(self):
         return(self.data[:,0])
@@ -28,56 +30,68 @@ class Measurement(object):
     def measured(self):
         return(self.data[:,1])
     
-    def corrected(self):
-        if self.corrected_data:
+    def corrected(self,factors=None):
+        if self.corrected_data is not None:
             return(self.corrected_data)
-        # Correct the trace data for each of the components
-        corrected = np.empty_like(self.data)
-        corrected[:] = self.data
-        for c in self.components:
-            corrected = c.corrected_measurement(corrected)
-        return(corrected[:,1])
+        # Correct the trace data for the sum of the component factors
+        correction = component.total_correction(self.freq(),self.components,factors)
+        self.corrected_data = self.measured() + correction
+        return(self.corrected_data)
     
     def limit(self):
-        if self.limit_data:
+        if self.limit_data is not None:
             return(self.limit_data)
-        return(self.lim.limit_func(self.freq()))
+        self.limit_data = self.lim.limit_func(self.freq())
+        return(self.limit_data)
     
     def add_trace(self,trace):
         self.data = np.empty_like(trace)
         self.data[:] = trace
+        self.corrected_data = None
+        self.limit_data = None
         
     def add_component(self,comp):
         self.components.append(comp)
+        self.corrected_data = None
     
     def add_limit(self,limit):
         self.lim = limit
+        self.limit_data = None
+    
+    def table(self):
+        freq = self.freq()
+        # The DSA and corrected readings
+        headings = ['Frequency (Hz)','DSA']
+        columns = [freq,self.measured()]
+        # Add all component data, evaluated once for the columns and correction
+        factors = [c.get_factors(freq) for c in self.components]
+        headings.extend(c.name for c in self.components)
+        columns.extend(factors)
+        # Add the corrected measurement
+        if len(self.components) > 0:
+            headings.append('Corrected')
+            columns.append(self.corrected(factors))
+        # Add the limit
+        if self.lim:
+            headings.append('Limit')
+            columns.append(self.limit())
+        # Assemble the columns into a single contiguous array
+        table = np.empty((len(self.data),len(columns)),dtype=np.float64)
+        for i,col in enumerate(columns):
+            table[:,i] = col
+        return(headings,table)
     
     def save_to_csv(self,filename):
-        with open(filename, 'w', newline='') as csvfile:
+        with open(filename, 'w', newline='', buffering=1<<20) as csvfile:
             w = csv.writer(csvfile, delimiter=',')
             w.writerow([self.title])
             # Write the DSA configuration
             w.writerow(self.config.get_json_names())
             w.writerow(self.config.get_json_values())
-            # Write the DSA and corrected readings
-            headings = ['Frequency (Hz)','DSA']
-            columns = [self.freq(),self.measured()]
-            # Add all component data
-            for c in self.components:
-                headings.append(c.name)
-                columns.append(c.get_factors(self.freq()))
-            # Add the corrected measurement
-            if len(self.components) > 0:
-                headings.append('Corrected')
-                columns.append(self.corrected())
-            # Add the limit
-            if self.lim:
-                headings.append('Limit')
-                columns.append(self.limit())
-            # Write the data
+            # Write the data, with the same line endings as the csv writer
+            headings,table = self.table()
             w.writerow(headings)
-            w.writerows(np.array(columns).T)
+            np.savetxt(csvfile, table, delimiter=',', fmt='%.12g', newline='\r\n')
         
     def load_csv(self,filename):
         with open(filename) as csvfile:
@@ -87,16 +101,18 @@ class Measurement(object):
             # DSA config
             config_keys = next(r)
             config_values = next(r)
-            self.config = rigol.dsa800.dsa800_config(config_keys,config_values)
-            # Data
+            self.config = rigol.dsa800.dsa800_config(json_keys=config_keys,
+                                                     json_values=config_values)
+            # Data, parsed by numpy from the rest of the file
             headings = next(r)
-            self.data = np.array(list(r),dtype=np.float)
-            # Get the corrected data and limit
-            heading_index = dict((v,i) for i,v in enumerate(headings))
-            self.corrected_data = self.data[:,heading_index['Corrected']]
-            self.limit_data = self.data[:,heading_index['Limit']]
+            self.data = np.loadtxt(csvfile,delimiter=',',dtype=np.float64,ndmin=2)
+            # Get the corrected data and limit, if they were saved
+            if 'Corrected' in headings:
+                self.corrected_data = self.data[:,headings.index('Corrected')]
+            if 'Limit' in headings:
+                self.limit_data = self.data[:,headings.index('Limit')]
         
-    def save_to_png(self,filename):
+    def save_to_png(self,filename,dpi=150):
         # Add .png extension to filename if needed
         if filename.endswith('.png') == False:
             filename = '%s.png' % filename
@@ -116,7 +132,7 @@ class Measurement(object):
         ymin, ymax = ax.yaxis.get_data_interval()
         ax.set_ylim([np.floor(ymin/5)*5,np.ceil(ymax/5)*5])
         plt.grid()
-        fig.savefig(filename, dpi=900)
+        fig.savefig(filename, dpi=dpi)
         plt.clf()
         plt.close(fig)
         